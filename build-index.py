@@ -6,10 +6,77 @@ Extracts lemmas from multiple Agda codebases and creates searchable indices
 import os
 import re
 import json
-import subprocess
+import multiprocessing
+import gzip
+import hashlib
+import html
+import shutil
+import sqlite3
 import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import orjson  # optional: much faster JSON encoding, same output
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # optional: smaller precompressed indices for serve.py
+except ImportError:
+    brotli = None
+
+# Bump whenever the parser's output or the cache schema changes so stale
+# cache entries are dropped
+CACHE_VERSION = 3
+
+# Files modified this recently are always re-read: another write within the
+# filesystem's timestamp granularity could leave mtime and size unchanged
+STAT_TRUST_AGE_NS = 2 * 10**9
+
+# Cache misses go to workers in batches of up to this many files or bytes,
+# so per-task pickling and IPC overhead is shared by many small files
+BATCH_MAX_FILES = 32
+BATCH_MAX_BYTES = 256 * 1024
+
+# Per-lemma columns of a lemma index, after the shared "files" table. Lemma i
+# is element i of every column; file_idx points into "files", and the *_html
+# columns are null wherever the escaped text equals the raw text.
+INDEX_COLUMNS = ("names", "names_html", "signatures", "signatures_html", "file_idx", "lines")
+
+# Columns are buffered in memory up to this size before spilling to disk
+COLUMN_SPOOL_BYTES = 4 * 1024 * 1024
+
+# Compressed copies of an index are written in chunks of this size
+COMPRESS_CHUNK_BYTES = 1024 * 1024
+
+# Directories that never hold source .agda files (VCS data, build output, interface caches)
+SKIP_DIRS = frozenset({".git", "_build", ".agda"})
+
+# Patterns are compiled once at import so every worker process reuses them.
+
+# One alternation classifies a line as a data block start, a record block
+# start or a type signature; dispatch on match.lastgroup.
+LINE_PATTERN = re.compile(
+    rb'^\s*(?:(?P<data>data\b.*\bwhere\b|data\s+\S+)'
+    rb'|(?P<record>record\s+\S+)'
+    rb'|(?P<sig>\S+)\s*:)'
+)
+
+# Signature-only classifier for lines that cannot open a data/record block
+SIGNATURE_PATTERN = re.compile(rb'^\s*(?P<sig>\S+)\s*:')
+
+# Start offsets of lines that may open a data/record block; found in one
+# pass over the whole file so other lines skip those branches entirely.
+BLOCK_KEYWORD_PATTERN = re.compile(rb'(?m)^[^\S\n]*(?:data|record)')
+
+# Lines that are neither blank nor a "--" comment; group 1 is the
+# indentation, so widths come out of the same per-file scan
+CONTENT_LINE_PATTERN = re.compile(rb'(?m)^([ \t]*)(?![^\S\n]*(?:--|$)).+')
+
 def load_config():
     """Load configuration with multiple codebases"""
     config_path = Path(__file__).parent / "config.json"
@@ -18,8 +85,8 @@ def load_config():
         print("Please create config.json with your Agda codebase paths.")
         sys.exit(1)
     
-    with open(config_path, 'r') as f:
-        config = json.load(f)
+    raw_config = config_path.read_bytes()
+    config = orjson.loads(raw_config) if orjson is not None else json.loads(raw_config)
     
     if 'codebases' not in config or not config['codebases']:
         print("❌ Error: No codebases configured in config.json")
@@ -27,209 +94,468 @@ def load_config():
     
     return config
 
-def collect_lemma_signatures(root_dir):
-    """Extract lemmas from Agda files"""
-    lemma_pattern = re.compile(r'^\s*(\S+)\s*:\s*(.*)$')
-    data_where_pattern = re.compile(r'^\s*data\b.*\bwhere\b')
-    data_pattern = re.compile(r'^\s*data\s+\S+')
-    record_pattern = re.compile(r'^\s*record\s+\S+')
-    lemmas = []
-    lemma_id = 0
+def _iter_agda_files(root_dir):
+    """Yield (path, relative path) for every .agda file under root_dir"""
+    stack = [root_dir]
+    prefix_len = len(root_dir.rstrip(os.sep)) + 1
+    while stack:
+        # Like os.walk, skip directories that cannot be listed
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith(".agda"):
+                    yield entry.path, entry.path[prefix_len:]
 
-    print(f"Scanning {root_dir} for .agda files...")
-    
-    for root, _, files in os.walk(root_dir):
-        for filename in files:
-            if filename.endswith(".agda"):
-                file_path = os.path.join(root, filename)
-                rel_path = os.path.relpath(file_path, root_dir)
-                
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        lines = f.readlines()
-                except UnicodeDecodeError:
-                    print(f"Warning: Could not read {file_path} (encoding issue)")
-                    continue
+class LemmaCache:
+    """Persistent cache of parsed lemmas, keyed by a hash of each file's content,
+    plus the last seen (mtime, size) and hash of each path so unchanged files
+    need not even be read"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS cache")
+            self.conn.execute("DROP TABLE IF EXISTS files")
+            self.conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, payload BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files "
+                          "(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, hash TEXT)")
+        self.used = set()
+
+    @staticmethod
+    def key(data):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def get(self, key):
+        self.used.add(key)
+        row = self.conn.execute("SELECT payload FROM cache WHERE hash = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
 
+    def put(self, key, lemmas):
+        self.used.add(key)
+        self.conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?)",
+                          (key, json.dumps(lemmas, ensure_ascii=False)))
+
+    def known_key(self, path, stat):
+        """Cache key recorded for path, if the file's mtime and size are unchanged"""
+        row = self.conn.execute("SELECT hash FROM files WHERE path = ? AND mtime_ns = ? AND size = ?",
+                                (path, stat.st_mtime_ns, stat.st_size)).fetchone()
+        return row[0] if row else None
+
+    def record(self, path, stat, key, seen_ns):
+        """Remember path's cache key under the mtime and size in stat, taken at
+        or after seen_ns and before the file was read"""
+        if seen_ns - stat.st_mtime_ns < STAT_TRUST_AGE_NS:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        else:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                              (path, stat.st_mtime_ns, stat.st_size, key))
+
+    def close(self, prune=False):
+        """Commit, optionally dropping entries no file referenced in this run"""
+        if prune:
+            self.conn.execute("CREATE TEMP TABLE used (hash TEXT PRIMARY KEY)")
+            self.conn.executemany("INSERT INTO used VALUES (?)", ((key,) for key in self.used))
+            self.conn.execute("DELETE FROM cache WHERE hash NOT IN (SELECT hash FROM used)")
+            self.conn.execute("DELETE FROM files WHERE hash NOT IN (SELECT hash FROM used)")
+        self.conn.commit()
+        self.conn.close()
+
+def _read_and_hash(file_path):
+    """Read a file and compute its cache key (hashing releases the GIL)"""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    return data, LemmaCache.key(data)
+
+def _read_ahead(file_paths, depth):
+    """Yield (data, key) for each path in order, reading up to depth files ahead on threads"""
+    with ThreadPoolExecutor() as readers:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(readers.submit(_read_and_hash, file_path))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _parse_agda_sources(sources):
+    """Parse a batch of file contents in one worker task"""
+    return [_parse_agda_source(data) for data in sources]
+
+def _parse_agda_source(data):
+    """Extract lemmas from the raw bytes of an Agda file as parallel
+    (names, signatures, lines) lists"""
+    names = []
+    signatures = []
+    lines = []
+
+    # Every signature contains a colon; files without one (re-export and
+    # prelude modules) cannot yield lemmas.
+    if b':' not in data:
+        return names, signatures, lines
+
+    reading_lemma = False
+    start_line = None
+    current_lemma_lines = []
+    current_lemma_name = None
+    current_lemma_indent = 0
+    current_lemma_prefix = b""
+    current_proof_prefixes = ()
+    data_block = False
+    record_block = False
+    block_indent_level = 0
+
+    def proof_prefixes(lemma_name):
+        """Line starts that begin a proof clause, for one str.startswith call"""
+        return (b'(',                  # Pattern matching with parentheses
+                b'...',                # Proof omission dots
+                lemma_name + b' ',     # Lemma name with space
+                lemma_name + b'(')     # Lemma name with parentheses
+
+    def emit():
+        """Append the lemma being read, using the name cached at its start"""
+        if current_lemma_name:
+            names.append(current_lemma_name.decode("utf-8", "replace"))
+            signatures.append(b"\n".join(current_lemma_lines).decode("utf-8", "replace"))
+            lines.append(start_line)
+
+    # Everything the parser looks at is ASCII, so scan raw bytes and only
+    # decode the signatures that are actually emitted.
+    if b'data' in data or b'record' in data:
+        block_starts = {m.start() for m in BLOCK_KEYWORD_PATTERN.finditer(data)}
+    else:
+        block_starts = set()
+
+    # Bind the per-line callables once; attribute and global lookups are
+    # a measurable share of this interpreter-bound loop.
+    count_newlines = data.count
+    match_line = LINE_PATTERN.match
+    match_signature = SIGNATURE_PATTERN.match
+
+    # Comment and blank lines are filtered out by the regex engine; line
+    # numbers are recovered by counting newlines between surviving lines.
+    i, pos = 1, 0
+    for content_match in CONTENT_LINE_PATTERN.finditer(data):
+        line = content_match.group()
+        line_start = content_match.start()
+        i += count_newlines(b"\n", pos, line_start)
+        pos = line_start
+        line_indent = content_match.end(1) - line_start
+
+        # Check for end of data/record blocks
+        if (data_block or record_block) and line_indent <= block_indent_level:
+            data_block = False
+            record_block = False
+            block_indent_level = 0
+
+        if not data_block and not record_block:
+            if pos in block_starts:
+                line_match = match_line(line)
+            elif b':' in line:
+                line_match = match_signature(line)
+            else:
+                line_match = None
+            line_kind = line_match.lastgroup if line_match else None
+
+            # Check for start of data/record blocks
+            if line_kind == 'data' or line_kind == 'record':
+                data_block = line_kind == 'data'
+                record_block = line_kind == 'record'
+                block_indent_level = line_indent
+                if reading_lemma and current_lemma_lines:
+                    emit()
                 reading_lemma = False
-                start_line = None
                 current_lemma_lines = []
-                data_block = False
-                record_block = False
-                block_indent_level = 0
-
-                for i, line in enumerate(lines, start=1):
-                    stripped_line = line.strip()
-                    line_indent = len(line) - len(line.lstrip())
-
-                    if stripped_line.startswith("--"):
-                        continue
-
-                    # Check for end of data/record blocks
-                    if (data_block or record_block) and line_indent <= block_indent_level and stripped_line:
-                        data_block = False
-                        record_block = False
-                        block_indent_level = 0
-
-                    if not data_block and not record_block:
-                        # Check for start of data blocks
-                        if data_where_pattern.search(line) or data_pattern.search(line):
-                            data_block = True
-                            block_indent_level = line_indent
-                            if reading_lemma and current_lemma_lines:
-                                lemma_text = "\n".join(current_lemma_lines).strip()
-                                lemma_name = extract_lemma_name(lemma_text)
-                                if lemma_name:
-                                    lemmas.append({
-                                        "id": lemma_id,
-                                        "name": lemma_name,
-                                        "signature": lemma_text,
-                                        "file": rel_path,
-                                        "line": start_line
-                                    })
-                                    lemma_id += 1
-                            reading_lemma = False
-                            current_lemma_lines = []
-                            continue
-                        
-                        # Check for record blocks
-                        if record_pattern.search(line):
-                            record_block = True
-                            block_indent_level = line_indent
-                            if reading_lemma and current_lemma_lines:
-                                lemma_text = "\n".join(current_lemma_lines).strip()
-                                lemma_name = extract_lemma_name(lemma_text)
-                                if lemma_name:
-                                    lemmas.append({
-                                        "id": lemma_id,
-                                        "name": lemma_name,
-                                        "signature": lemma_text,
-                                        "file": rel_path,
-                                        "line": start_line
-                                    })
-                                    lemma_id += 1
-                            reading_lemma = False
-                            current_lemma_lines = []
-                            continue
-                    else:
-                        # Inside data/record block - skip constructor/field definitions
-                        if reading_lemma and current_lemma_lines:
-                            lemma_text = "\n".join(current_lemma_lines).strip()
-                            lemma_name = extract_lemma_name(lemma_text)
-                            if lemma_name:
-                                lemmas.append({
-                                    "id": lemma_id,
-                                    "name": lemma_name,
-                                    "signature": lemma_text,
-                                    "file": rel_path,
-                                    "line": start_line
-                                })
-                                lemma_id += 1
-                        reading_lemma = False
-                        current_lemma_lines = []
-                        continue
-
-                    # Check for proof start patterns
-                    proof_started = False
-                    
-                    # Lines with ' = ' mark the start of a proof
-                    if " = " in line:
-                        proof_started = True
-                    
-                    # Pattern matching and proof patterns 
-                    elif reading_lemma and current_lemma_lines:
-                        first_line = current_lemma_lines[0]
-                        first_line_indent = len(first_line) - len(first_line.lstrip())
-                        
-                        # Extract lemma name for detection
-                        lemma_name_match = re.match(r'^\s*(\S+)\s*:', first_line)
-                        lemma_name = lemma_name_match.group(1) if lemma_name_match else ""
-                        
-                        # Check for proof patterns at lemma level (same indentation as lemma name)
-                        if line_indent == first_line_indent:
-                            if (stripped_line.startswith('(') or      # Pattern matching with parentheses
-                                stripped_line.startswith(lemma_name + ' ') or  # Lemma name with space
-                                (lemma_name in stripped_line and '=' in line) or  # Lemma name with equals
-                                stripped_line.startswith(lemma_name + '(') or   # Lemma name with parentheses
-                                stripped_line.startswith('...')):    # Proof omission dots
-                                proof_started = True
-
-                    # If proof started and we have a current lemma, save it
-                    if proof_started and reading_lemma and current_lemma_lines:
-                        lemma_text = "\n".join(current_lemma_lines).strip()
-                        lemma_name = extract_lemma_name(lemma_text)
-                        if lemma_name:
-                            lemmas.append({
-                                "id": lemma_id,
-                                "name": lemma_name,
-                                "signature": lemma_text,
-                                "file": rel_path,
-                                "line": start_line
-                            })
-                            lemma_id += 1
-                        reading_lemma = False
-                        current_lemma_lines = []
-                        continue
-
-                    # Start reading a new lemma if line looks like a type signature
-                    if lemma_pattern.match(line) and not reading_lemma:
-                        reading_lemma = True
-                        start_line = i
-                        current_lemma_lines = [line.rstrip()]
-                    elif reading_lemma:
-                        # Continue reading the signature if indented properly
-                        if line.strip() and (line.startswith(' ') or line.startswith('\t')):
-                            current_lemma_lines.append(line.rstrip())
-                        elif line.strip():
-                            # Non-indented line that's not empty - might be a new definition
-                            if lemma_pattern.match(line):
-                                # Save current lemma if it exists
-                                if current_lemma_lines:
-                                    lemma_text = "\n".join(current_lemma_lines).strip()
-                                    lemma_name = extract_lemma_name(lemma_text)
-                                    if lemma_name:
-                                        lemmas.append({
-                                            "id": lemma_id,
-                                            "name": lemma_name,
-                                            "signature": lemma_text,
-                                            "file": rel_path,
-                                            "line": start_line
-                                        })
-                                        lemma_id += 1
-                                
-                                # Start new lemma
-                                reading_lemma = True
-                                start_line = i
-                                current_lemma_lines = [line.rstrip()]
-                            else:
-                                reading_lemma = False
-                                current_lemma_lines = []
-
-                # Handle any remaining lemma at end of file
-                if reading_lemma and current_lemma_lines:
-                    lemma_text = "\n".join(current_lemma_lines).strip()
-                    lemma_name = extract_lemma_name(lemma_text)
-                    if lemma_name:
-                        lemmas.append({
-                            "id": lemma_id,
-                            "name": lemma_name,
-                            "signature": lemma_text,
-                            "file": rel_path,
-                            "line": start_line
-                        })
-                        lemma_id += 1
-
-    return lemmas
-
-def extract_lemma_name(lemma_text):
-    """Extract lemma name from the signature text"""
-    lines = lemma_text.split('\n')
-    first_line = lines[0].strip()
+                continue
+        else:
+            # Inside data/record block - skip constructor/field definitions
+            if reading_lemma and current_lemma_lines:
+                emit()
+            reading_lemma = False
+            current_lemma_lines = []
+            continue
+
+        # Check for proof start patterns
+        proof_started = False
+    
+        # Lines with ' = ' mark the start of a proof
+        if b" = " in line:
+            proof_started = True
     
-    # Match pattern: lemma_name : type
-    match = re.match(r'^\s*([^\s:]+)\s*:', first_line)
-    if match:
-        return match.group(1)
+        # Pattern matching and proof patterns 
+        elif reading_lemma and current_lemma_lines:
+            # Check for proof patterns at lemma level (same indentation as lemma name)
+            if line_indent == current_lemma_indent:
+                stripped_line = line.strip()
+                if (stripped_line.startswith(current_proof_prefixes) or
+                    (current_lemma_prefix in stripped_line and b'=' in line)):  # Lemma name with equals
+                    proof_started = True
+
+        # If proof started and we have a current lemma, save it
+        if proof_started and reading_lemma and current_lemma_lines:
+            emit()
+            reading_lemma = False
+            current_lemma_lines = []
+            continue
+
+        # Start reading a new lemma if line looks like a type signature
+        # The first line is stored fully stripped (its indentation is kept
+        # separately) so emitting needs no extra strip of the joined text
+        if line_kind == 'sig' and not reading_lemma:
+            reading_lemma = True
+            start_line = i
+            current_lemma_lines = [line.strip()]
+            current_lemma_indent = line_indent
+            current_lemma_prefix = line_match.group('sig')
+            current_proof_prefixes = proof_prefixes(current_lemma_prefix)
+            current_lemma_name = extract_lemma_name(line)
+        elif reading_lemma:
+            # Continue reading the signature if indented properly
+            if line.startswith((b' ', b'\t')):
+                current_lemma_lines.append(line.rstrip())
+            else:
+                # Non-indented line - might be a new definition
+                if line_kind == 'sig':
+                    # Save current lemma if it exists
+                    if current_lemma_lines:
+                        emit()
+                
+                    # Start new lemma
+                    reading_lemma = True
+                    start_line = i
+                    current_lemma_lines = [line.strip()]
+                    current_lemma_indent = line_indent
+                    current_lemma_prefix = line_match.group('sig')
+                    current_proof_prefixes = proof_prefixes(current_lemma_prefix)
+                    current_lemma_name = extract_lemma_name(line)
+                else:
+                    reading_lemma = False
+                    current_lemma_lines = []
+
+    # Handle any remaining lemma at end of file
+    if reading_lemma and current_lemma_lines:
+        emit()
+
+    return names, signatures, lines
+
+class _ParseBatch:
+    """Cache-miss files parsed together by a single worker task"""
+
+    def __init__(self):
+        self.sources = []
+        self.size = 0
+        self.future = None
+
+    def add(self, data):
+        """Queue a file's bytes and return its position in the batch"""
+        self.sources.append(data)
+        self.size += len(data)
+        return len(self.sources) - 1
+
+    def full(self):
+        return len(self.sources) >= BATCH_MAX_FILES or self.size >= BATCH_MAX_BYTES
+
+    def submit(self, executor):
+        if self.future is None:
+            self.future = executor.submit(_parse_agda_sources, self.sources)
+            self.sources = None
+
+def _parse_worker_count():
+    return max(1, (os.cpu_count() or 1) - 1)
+
+def _parse_pool():
+    """Process pool for parsing cache misses. Workers start via forkserver (spawn
+    where that is unavailable), never fork: the read-ahead threads are already
+    running when the first task is submitted, and forking a multi-threaded
+    process can deadlock the child."""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=_parse_worker_count(), mp_context=context)
+
+def collect_lemma_signatures(root_dir, cache=None, executor=None):
+    """Yield (relative path, (names, signatures, lines)) for each Agda file in
+    walk order, reusing cached results. Cache misses are parsed on executor,
+    or on a private process pool if none is given."""
+    if executor is None:
+        with _parse_pool() as executor:
+            yield from collect_lemma_signatures(root_dir, cache, executor)
+        return
+
+    print(f"Scanning {root_dir} for .agda files...")
+
+    agda_files = list(_iter_agda_files(root_dir))
+    max_workers = _parse_worker_count()
+    parsed = 0
+
+    def finish(rel_path, key, result, batch, position):
+        if batch is not None:
+            batch.submit(executor)
+            result = batch.future.result()[position]
+            if cache:
+                cache.put(key, result)
+        return rel_path, result
+
+    # Cache misses are parsed in worker processes, several small files per
+    # task. Results are consumed in walk order (so lemma ids stay stable
+    # between builds) from a bounded window, so neither file contents nor
+    # lemmas pile up in memory.
+    pending = deque()
+    batch = _ParseBatch()
+    # Files whose mtime and size match the last build are looked up by
+    # their recorded hash without being read at all.
+    # The trust check in LemmaCache.record compares mtimes against this time,
+    # taken before any file is stat'ed or read, not against when the row is
+    # written, which can be much later.
+    seen_ns = time.time_ns()
+    stats = [os.stat(file_path) for file_path, _ in agda_files]
+    if cache:
+        known_keys = [cache.known_key(file_path, stat) for (file_path, _), stat in zip(agda_files, stats)]
+    else:
+        known_keys = [None] * len(agda_files)
+    # Reader threads keep a bounded window of files in flight so disk
+    # latency overlaps with parsing in the worker processes.
+    file_paths = (file_path for (file_path, _), key in zip(agda_files, known_keys) if key is None)
+    read_ahead = _read_ahead(file_paths, 2 * max_workers + 2)
+    for (file_path, rel_path), stat, key in zip(agda_files, stats, known_keys):
+        result = cache.get(key) if key else None
+        if result is None:
+            # Read-ahead covers exactly the files without a known key
+            data, key = next(read_ahead) if key is None else _read_and_hash(file_path)
+            if cache:
+                cache.record(file_path, stat, key, seen_ns)
+                result = cache.get(key)
+        if result is None:
+            # finish() submits a partly filled batch when its oldest file
+            # leaves the window; later misses must go to a fresh batch
+            if batch.future is not None:
+                batch = _ParseBatch()
+            pending.append((rel_path, key, None, batch, batch.add(data)))
+            parsed += 1
+            if batch.full():
+                batch.submit(executor)
+                batch = _ParseBatch()
+        else:
+            pending.append((rel_path, key, result, None, None))
+        if len(pending) > 2 * max_workers * BATCH_MAX_FILES:
+            yield finish(*pending.popleft())
+    while pending:
+        yield finish(*pending.popleft())
+
+    # Cache hits include files whose content duplicates one parsed earlier in
+    # this run, so they are reported as reused rather than unchanged
+    print(f"Parsed {parsed} of {len(agda_files)} files ({len(agda_files) - parsed} reused from cache)")
+
+def _encode_value(value):
+    """Encode one JSON value (no indentation) as UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+def write_lemma_index(path, files):
+    """Stream per-file (relative path, (names, signatures, lines)) into a compact columnar JSON index,
+    where a lemma's id is its position in every column. Returns the lemma count; nothing is
+    written for zero."""
+    file_table = []
+    # Each column is spooled on its own (spilling to disk when large) and the
+    # columns are concatenated at the end, so lemmas never pile up in memory
+    columns = {column: tempfile.SpooledTemporaryFile(max_size=COLUMN_SPOOL_BYTES)
+               for column in INDEX_COLUMNS}
+    count = 0
+    try:
+        for rel_path, (names, signatures, lines) in files:
+            if not names:
+                continue
+            file_index = _encode_value(len(file_table))
+            file_table.append(rel_path)
+            for name, signature, line in zip(names, signatures, lines):
+                separator = b"," if count else b""
+                # Escaped once here so the page never escapes per render; null
+                # where escaping changes nothing, which is most lemmas
+                name_html = html.escape(name, quote=False)
+                signature_html = html.escape(signature, quote=False)
+                for column, encoded in (
+                        ("names", _encode_value(name)),
+                        ("names_html", _encode_value(name_html if name_html != name else None)),
+                        ("signatures", _encode_value(signature)),
+                        ("signatures_html", _encode_value(signature_html if signature_html != signature else None)),
+                        ("file_idx", file_index),
+                        ("lines", _encode_value(line))):
+                    spool = columns[column]
+                    spool.write(separator)
+                    spool.write(encoded)
+                count += 1
+
+        if not count:
+            return 0
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(b'{"files":[')
+            f.write(b",".join(_encode_value(rel_path) for rel_path in file_table))
+            f.write(b"]")
+            for column in INDEX_COLUMNS:
+                spool = columns[column]
+                spool.seek(0)
+                f.write(b',"' + column.encode('ascii') + b'":[')
+                shutil.copyfileobj(spool, f)
+                f.write(b"]")
+            f.write(b"}")
+        os.replace(tmp_path, path)
+    finally:
+        for spool in columns.values():
+            spool.close()
+    return count
+
+def _write_gzip_copy(source, tmp_path):
+    # No embedded name and mtime=0 keep the output identical across builds
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=raw, mtime=0) as f:
+            shutil.copyfileobj(source, f, COMPRESS_CHUNK_BYTES)
+
+def _write_brotli_copy(source, tmp_path):
+    compressor = brotli.Compressor(quality=11)
+    with open(tmp_path, 'wb') as f:
+        while chunk := source.read(COMPRESS_CHUNK_BYTES):
+            f.write(compressor.process(chunk))
+        f.write(compressor.finish())
+
+def write_compressed_copies(path):
+    """Write .gz (and, with brotli installed, .br) siblings of path for serve.py,
+    streaming so neither the index nor its compressed form is held in memory"""
+    writers = [(".gz", _write_gzip_copy)]
+    if brotli is not None:
+        writers.append((".br", _write_brotli_copy))
+    for suffix, write_copy in writers:
+        compressed_path = path.with_name(path.name + suffix)
+        tmp_path = compressed_path.with_name(compressed_path.name + ".tmp")
+        with open(path, 'rb') as source:
+            write_copy(source, tmp_path)
+        os.replace(tmp_path, compressed_path)
+
+def write_json(path, data):
+    """Write data as 2-space indented UTF-8 JSON, via orjson when available"""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+def extract_lemma_name(first_line):
+    """Extract lemma name from the (bytes) first line of a signature"""
+    # Pattern: lemma_name : type -- the name is the token before the first colon
+    head, colon, _ = first_line.partition(b':')
+    fields = head.split(None, 1)
+    if colon and fields:
+        return fields[0]
     return None
 
 def create_multi_codebase_search_html(output_dir, combined_data):
@@ -257,25 +583,29 @@ def create_multi_codebase_search_html(output_dir, combined_data):
     
     # Find and replace the codebase options in the existing HTML
     # Look for the select element with id="codebaseSelect"
-    import re
-    
-    # Pattern to match the select element and its options
-    select_pattern = r'(<select id="codebaseSelect">)(.*?)(</select>)'
+    opening_tag = '<select id="codebaseSelect">'
+    closing_tag = '</select>'
+    options_start = html_content.find(opening_tag)
+    options_end = html_content.find(closing_tag, options_start) if options_start != -1 else -1
     
-    def replace_options(match):
-        opening_tag = match.group(1)
-        closing_tag = match.group(3)
-        return f"{opening_tag}\n                    {options_html}\n                {closing_tag}"
+    # Splice the new options between the tags (plain slicing, no regex scan)
+    if options_end != -1:
+        options_start += len(opening_tag)
+        updated_html = (html_content[:options_start]
+                        + f"\n                    {options_html}\n                "
+                        + html_content[options_end:])
+    else:
+        updated_html = html_content
     
-    # Replace the options
-    updated_html = re.sub(select_pattern, replace_options, html_content, flags=re.DOTALL)
+    # Nothing to do if the options are already current
+    if html_content == updated_html:
+        return template_path
     
-    # Create a backup of the original file if it's different
+    # Create a backup of the original file before changing it
     backup_path = output_dir / "index.html.backup"
-    if html_content != updated_html:
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        print(f"   • Backup created: {backup_path}")
+    with open(backup_path, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+    print(f"   • Backup created: {backup_path}")
     
     # Write the updated HTML
     with open(template_path, 'w', encoding='utf-8') as f:
@@ -301,6 +631,9 @@ def main():
     
     # Build indices for all codebases
     all_indices = {}
+    cache = LemmaCache(script_dir / ".lemma-cache.sqlite")
+    # One worker pool serves every codebase, so processes start only once
+    executor = _parse_pool()
     
     for codebase in codebases:
         nickname = codebase['nickname']
@@ -314,27 +647,36 @@ def main():
             print(f"❌ Error: Directory {path} does not exist! Skipping.")
             continue
         
-        # Extract lemmas for this codebase
-        lemmas = collect_lemma_signatures(path)
-        print(f"✅ Found {len(lemmas)} lemmas")
+        # Extract lemmas for this codebase, streaming them into its index
+        individual_path = output_dir / f"lemma_index_{nickname.lower().replace(' ', '_')}.json"
+        count = write_lemma_index(individual_path, collect_lemma_signatures(path, cache, executor))
+        print(f"✅ Found {count} lemmas")
+        if count:
+            write_compressed_copies(individual_path)
         
-        if len(lemmas) == 0:
+        if count == 0:
             print(f"⚠️  No lemmas found in {nickname}")
             continue
         
-        # Store index for this codebase
+        # Only metadata is kept in memory
         all_indices[nickname] = {
-            'lemmas': lemmas,
             'description': description,
             'path': path,
-            'count': len(lemmas)
+            'count': count,
+            'index_path': individual_path
         }
     
+    executor.shutdown()
+    
+    # Only prune when every codebase was scanned, so a temporarily missing
+    # path does not evict its entries
+    cache.close(prune=all(os.path.exists(cb['path']) for cb in codebases))
+
     if not all_indices:
         print("❌ No lemmas found in any codebase!")
         return 1
     
-    # Save individual indices and create combined data
+    # Individual indices are already written; create combined data
     print(f"\n💾 Saving indices...")
     
     # Save combined index with codebase metadata
@@ -344,10 +686,7 @@ def main():
     }
     
     for nickname, data in all_indices.items():
-        # Save individual index
-        individual_path = output_dir / f"lemma_index_{nickname.lower().replace(' ', '_')}.json"
-        with open(individual_path, 'w', encoding='utf-8') as f:
-            json.dump(data['lemmas'], f, indent=2, ensure_ascii=False)
+        individual_path = data['index_path']
         print(f"   • {nickname}: {individual_path} ({data['count']} lemmas)")
         
         # Add to combined data
@@ -360,8 +699,7 @@ def main():
     
     # Save combined metadata
     metadata_path = output_dir / "codebases.json"
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(combined_data, f, indent=2, ensure_ascii=False)
+    write_json(metadata_path, combined_data)
     print(f"   • Metadata: {metadata_path}")
     
     # Update HTML search interface using existing template
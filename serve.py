@@ -4,11 +4,107 @@ Agda Lemma Search - HTTP Server
 Launches the search interface on http://localhost:8002
 """
 import http.server
-import socketserver
 import webbrowser
 import os
 import sys
 
+# Precompressed siblings written by build-index.py, in order of preference
+PRECOMPRESSED = [("br", ".br"), ("gzip", ".gz")]
+
+def accepted_encodings(header):
+    """Content codings from an Accept-Encoding header, minus those with q=0"""
+    encodings = set()
+    for item in header.split(","):
+        coding, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+class LemmaSearchHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler that serves precompressed .br/.gz copies of JSON indices
+    and lets browsers revalidate with ETags instead of re-downloading"""
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            # Directory listings, redirects and 404s
+            return super().send_head()
+
+        f, encoding = None, None
+        if path.endswith(".json"):
+            accepted = accepted_encodings(self.headers.get("Accept-Encoding", ""))
+            for candidate, suffix in PRECOMPRESSED:
+                if candidate in accepted:
+                    f = self.open_compressed(path, path + suffix)
+                    if f is not None:
+                        encoding = candidate
+                        break
+        if f is None:
+            try:
+                f = open(path, "rb")
+            except OSError:
+                self.send_error(404, "File not found")
+                return None
+
+        # Each build rewrites the files, so mtime and size identify a version;
+        # every representation (plain, gzip, br) is its own file and ETag
+        fs = os.fstat(f.fileno())
+        etag = f'"{fs.st_mtime_ns:x}-{fs.st_size:x}"'
+        if_none_match = self.headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(",")):
+            f.close()
+            self.send_response(304)
+            self.send_cache_headers(path, etag)
+            self.end_headers()
+            return None
+
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(fs.st_size))
+        self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+        self.send_cache_headers(path, etag)
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        # Hand file bodies to the kernel (os.sendfile where available) instead
+        # of copying them through small userspace buffers
+        if outputfile is self.wfile:
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
+    def send_cache_headers(self, path, etag):
+        self.send_header("ETag", etag)
+        # Always revalidate: an index changes as soon as build-index.py runs,
+        # and an unchanged one costs only a 304
+        self.send_header("Cache-Control", "no-cache")
+        if path.endswith(".json"):
+            self.send_header("Vary", "Accept-Encoding")
+
+    @staticmethod
+    def open_compressed(path, compressed_path):
+        """Open compressed_path unless it is missing or older than path"""
+        try:
+            f = open(compressed_path, "rb")
+        except OSError:
+            return None
+        # A stale copy (e.g. the index was updated by git) must not be served
+        if os.fstat(f.fileno()).st_mtime_ns < os.stat(path).st_mtime_ns:
+            f.close()
+            return None
+        return f
+
 def main():
     PORT = 8002
     
@@ -28,7 +124,7 @@ def main():
     print("Press Ctrl+C to stop the server")
     
     try:
-        with socketserver.TCPServer(("", PORT), http.server.SimpleHTTPRequestHandler) as httpd:
+        with http.server.ThreadingHTTPServer(("", PORT), LemmaSearchHandler) as httpd:
             print(f"✅ Server running on port {PORT}")
             
             # Open browser